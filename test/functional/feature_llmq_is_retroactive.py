@@ -3,9 +3,12 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
+from contextlib import contextmanager, ExitStack
+import re
+
 from test_framework.mininode import *
 from test_framework.test_framework import DashTestFramework
-from test_framework.util import set_node_times, isolate_node, reconnect_isolated_node
+from test_framework.util import batch_rpc, set_node_times, isolate_node, reconnect_isolated_node
 
 '''
 feature_llmq_is_retroactive.py
@@ -50,12 +53,12 @@ class LLMQ_IS_RetroactiveSigning(DashTestFramework):
         block = self.nodes[0].generate(1)[0]
         self.wait_for_instantlock(txid, self.nodes[0])
         self.nodes[0].spork("SPORK_19_CHAINLOCKS_ENABLED", 0)
-        self.wait_for_sporks_same()
-        self.wait_for_chainlocked_block_all_nodes(block)
-
+        # The tx is already locked and mined, so we can enable mempool IS signing
+        # right away and wait for both spork changes to propagate at once
         self.log.info("Enable mempool IS signing")
         self.nodes[0].spork("SPORK_2_INSTANTSEND_ENABLED", 0)
         self.wait_for_sporks_same()
+        self.wait_for_chainlocked_block_all_nodes(block)
 
         self.log.info("trying normal IS lock")
         txid = self.nodes[0].sendtoaddress(self.nodes[0].getnewaddress(), 1)
@@ -71,8 +74,7 @@ class LLMQ_IS_RetroactiveSigning(DashTestFramework):
         txid = self.nodes[0].sendtoaddress(self.nodes[0].getnewaddress(), 1)
         # Make sure nodes 1 and 2 received the TX before we continue,
         # otherwise it might announce the TX to node 3 when reconnecting
-        self.wait_for_tx(txid, self.nodes[1])
-        self.wait_for_tx(txid, self.nodes[2])
+        rawtx = self.wait_for_tx_all_nodes(txid, self.nodes[1:3])
         reconnect_isolated_node(self.nodes[3], 0)
         # Make sure nodes actually try re-connecting quorum connections
         self.bump_mocktime(30)
@@ -80,7 +82,7 @@ class LLMQ_IS_RetroactiveSigning(DashTestFramework):
         # node 3 fully reconnected but the TX wasn't relayed to it, so there should be no IS lock
         self.wait_for_instantlock(txid, self.nodes[0], False, 5)
         # push the tx directly via rpc
-        self.nodes[3].sendrawtransaction(self.nodes[0].getrawtransaction(txid))
+        self.nodes[3].sendrawtransaction(rawtx)
         # node 3 should vote on a tx now since it became aware of it via sendrawtransaction
         # and this should be enough to complete an IS lock
         self.wait_for_instantlock(txid, self.nodes[0])
@@ -103,8 +105,7 @@ class LLMQ_IS_RetroactiveSigning(DashTestFramework):
         txid = self.nodes[0].sendtoaddress(self.nodes[0].getnewaddress(), 1)
         # Make sure nodes 1 and 2 received the TX before we continue,
         # otherwise it might announce the TX to node 3 when reconnecting
-        self.wait_for_tx(txid, self.nodes[1])
-        self.wait_for_tx(txid, self.nodes[2])
+        self.wait_for_tx_all_nodes(txid, self.nodes[1:3])
         reconnect_isolated_node(self.nodes[3], 0)
         # Make sure nodes actually try re-connecting quorum connections
         self.bump_mocktime(30)
@@ -117,37 +118,78 @@ class LLMQ_IS_RetroactiveSigning(DashTestFramework):
         assert(txid in self.nodes[0].getblock(block, 1)['tx'])
         self.wait_for_chainlocked_block_all_nodes(block)
 
+        # Build the transactions for all session timeout tests at once
+        rawtxs = self.create_raw_txs(4)
+
         self.log.info("testing retroactive signing with partially known TX and all nodes session timeout")
-        self.test_all_nodes_session_timeout(False)
+        self.test_all_nodes_session_timeout(False, rawtxs[0])
         self.log.info("repeating test, but with cycled LLMQs")
-        self.test_all_nodes_session_timeout(True)
+        self.test_all_nodes_session_timeout(True, rawtxs[1])
 
         self.log.info("testing retroactive signing with partially known TX and single node session timeout")
-        self.test_single_node_session_timeout(False)
+        self.test_single_node_session_timeout(False, rawtxs[2])
         self.log.info("repeating test, but with cycled LLMQs")
-        self.test_single_node_session_timeout(True)
+        self.test_single_node_session_timeout(True, rawtxs[3])
+
+    def create_raw_txs(self, count):
+        # Each step is a single JSON-RPC batch request for all transactions. Inputs
+        # are locked while funding so that the transactions don't conflict.
+        node = self.nodes[0]
+        addresses = batch_rpc(node, [node.getnewaddress.get_request() for _ in range(count)])
+        rawtxs = batch_rpc(node, [node.createrawtransaction.get_request([], {address: 1}) for address in addresses])
+        rawtxs = batch_rpc(node, [node.fundrawtransaction.get_request(rawtx, {"lockUnspents": True}) for rawtx in rawtxs])
+        rawtxs = batch_rpc(node, [node.signrawtransactionwithwallet.get_request(r["hex"]) for r in rawtxs])
+        return [r["hex"] for r in rawtxs]
+
+    def tx_hash(self, rawtx):
+        tx = FromHex(CTransaction(), rawtx)
+        tx.rehash()
+        return tx.hash
+
+    def input_request_ids(self, rawtx):
+        # Each input of a tx is signed in its own signing session, its request id is the hash
+        # of the "inlock" prefix and the outpoint (see INPUTLOCK_REQUESTID_PREFIX)
+        tx = FromHex(CTransaction(), rawtx)
+        return [hash256(ser_string(b"inlock") + txin.prevout.serialize())[::-1].hex() for txin in tx.vin]
+
+    def signing_session_log_patterns(self, msg, rawtx):
+        # One pattern per input, each one has to match a single log line for the session of that input
+        txid = self.tx_hash(rawtx)
+        return [r"%s\. signHash=\w+, id=%s, msgHash=%s" % (re.escape(msg), request_id, txid) for request_id in self.input_request_ids(rawtx)]
+
+    @contextmanager
+    def wait_for_debug_log_all(self, nodes, expected_msgs, timeout=10):
+        with ExitStack() as stack:
+            for node in nodes:
+                stack.enter_context(node.wait_for_debug_log(expected_msgs, timeout=timeout, use_regex=True))
+            yield
+
+    def wait_for_sigshares_created(self, rawtx, nodes):
+        return self.wait_for_debug_log_all(nodes, self.signing_session_log_patterns("created sigShare", rawtx))
+
+    def timeout_signing_sessions(self, rawtx, nodes):
+        # Move past SESSION_NEW_SHARES_TIMEOUT, the next Cleanup() run on each node then removes
+        # the sessions of the tx's inputs. Block until that happened instead of sleeping for a fixed time.
+        with self.wait_for_debug_log_all(nodes, self.signing_session_log_patterns("signing session timed out", rawtx)):
+            self.bump_mocktime(61)
 
     def cycle_llmqs(self):
         self.mine_quorum()
         self.mine_quorum()
         self.wait_for_chainlocked_block_all_nodes(self.nodes[0].getbestblockhash(), timeout=30)
 
-    def test_all_nodes_session_timeout(self, do_cycle_llmqs):
+    def test_all_nodes_session_timeout(self, do_cycle_llmqs, rawtx):
         set_node_times(self.nodes, self.mocktime)
         isolate_node(self.nodes[3])
-        rawtx = self.nodes[0].createrawtransaction([], {self.nodes[0].getnewaddress(): 1})
-        rawtx = self.nodes[0].fundrawtransaction(rawtx)['hex']
-        rawtx = self.nodes[0].signrawtransactionwithwallet(rawtx)['hex']
-        txid = self.nodes[0].sendrawtransaction(rawtx)
-        txid = self.nodes[3].sendrawtransaction(rawtx)
-        # Make sure nodes 1 and 2 received the TX before we continue
-        self.wait_for_tx(txid, self.nodes[1])
-        self.wait_for_tx(txid, self.nodes[2])
-        # Make sure signing is done on nodes 1 and 2 (it's async)
-        time.sleep(5)
+        txid = self.tx_hash(rawtx)
+        # Make sure signing is done on nodes 1-3 (it's async)
+        with self.wait_for_sigshares_created(rawtx, self.nodes[1:4]):
+            self.nodes[0].sendrawtransaction(rawtx)
+            self.nodes[3].sendrawtransaction(rawtx)
+            # Make sure nodes 1 and 2 received the TX before we continue
+            self.wait_for_tx_all_nodes(txid, self.nodes[1:3])
         # Make the signing session for the IS lock timeout on nodes 1-3
-        self.bump_mocktime(61)
-        time.sleep(2) # make sure Cleanup() is called
+        self.timeout_signing_sessions(rawtx, self.nodes[1:4])
         reconnect_isolated_node(self.nodes[3], 0)
         # Make sure nodes actually try re-connecting quorum connections
         self.bump_mocktime(30)
@@ -163,27 +205,23 @@ class LLMQ_IS_RetroactiveSigning(DashTestFramework):
         assert(txid in self.nodes[0].getblock(block, 1)['tx'])
         self.wait_for_chainlocked_block_all_nodes(block)
 
-    def test_single_node_session_timeout(self, do_cycle_llmqs):
+    def test_single_node_session_timeout(self, do_cycle_llmqs, rawtx):
         set_node_times(self.nodes, self.mocktime)
         isolate_node(self.nodes[3])
-        rawtx = self.nodes[0].createrawtransaction([], {self.nodes[0].getnewaddress(): 1})
-        rawtx = self.nodes[0].fundrawtransaction(rawtx)['hex']
-        rawtx = self.nodes[0].signrawtransactionwithwallet(rawtx)['hex']
-        txid = self.nodes[3].sendrawtransaction(rawtx)
-        time.sleep(2) # make sure signing is done on node 2 (it's async)
+        # make sure signing is done on node 3 (it's async)
+        with self.wait_for_sigshares_created(rawtx, [self.nodes[3]]):
+            txid = self.nodes[3].sendrawtransaction(rawtx)
         # Make the signing session for the IS lock timeout on node 3
-        self.bump_mocktime(61)
-        time.sleep(2) # make sure Cleanup() is called
+        self.timeout_signing_sessions(rawtx, [self.nodes[3]])
         reconnect_isolated_node(self.nodes[3], 0)
         # Make sure nodes actually try re-connecting quorum connections
         self.bump_mocktime(30)
         self.wait_for_mnauth(self.nodes[3], 2)
-        self.nodes[0].sendrawtransaction(rawtx)
-        # Make sure nodes 1 and 2 received the TX
-        self.wait_for_tx(txid, self.nodes[1])
-        self.wait_for_tx(txid, self.nodes[2])
         # Make sure signing is done on nodes 1 and 2 (it's async)
-        time.sleep(5)
+        with self.wait_for_sigshares_created(rawtx, self.nodes[1:3]):
+            self.nodes[0].sendrawtransaction(rawtx)
+            # Make sure nodes 1 and 2 received the TX
+            self.wait_for_tx_all_nodes(txid, self.nodes[1:3])
         # node 3 fully reconnected but the signing session is already timed out on it, so no IS lock
         self.wait_for_instantlock(txid, self.nodes[0], False, 1)
         if do_cycle_llmqs:
@@ -3,6 +3,8 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
+from concurrent.futures import ThreadPoolExecutor
+
 from test_framework.mininode import *
 from test_framework.test_framework import DashTestFramework
 from test_framework.util import *
@@ -23,7 +25,19 @@ class LLMQSigningTest(DashTestFramework):
         parser.add_option("--spork21", dest="spork21", default=False, action="store_true",
                           help="Test with spork21 enabled")
 
+    def mine_quorum(self, *args, **kwargs):
+        # A new quorum changes the active set, forget all previous selections
+        self.selected_quorums.clear()
+        return super().mine_quorum(*args, **kwargs)
+
+    def select_quorum(self, id):
+        # Selection is deterministic for a given set of active quorums, ask the node only once per id
+        if id not in self.selected_quorums:
+            self.selected_quorums[id] = self.nodes[0].quorum("selectquorum", 100, id)
+        return self.selected_quorums[id]
+
     def run_test(self):
+        self.selected_quorums = {}
 
         self.nodes[0].spork("SPORK_17_QUORUM_DKG_ENABLED", 0)
         if self.options.spork21:
@@ -32,28 +46,51 @@ class LLMQSigningTest(DashTestFramework):
 
         self.mine_quorum()
 
+        # The masternode nodes, shared by sign_all() and check_sigs() below
+        mn_nodes = [mn.node for mn in self.mninfo]
+
         if self.options.spork21:
-            assert self.mninfo[0].node.getconnectioncount() == self.llmq_size
+            assert mn_nodes[0].getconnectioncount() == self.llmq_size
 
         id = "0000000000000000000000000000000000000000000000000000000000000001"
         msgHash = "0000000000000000000000000000000000000000000000000000000000000002"
         msgHashConflict = "0000000000000000000000000000000000000000000000000000000000000003"
 
+        # The masternode which failed the previous check is the most likely one to fail the next one too
+        last_failed_node = mn_nodes[0]
+
         def check_sigs(hasrecsigs, isconflicting1, isconflicting2):
-            for mn in self.mninfo:
-                if mn.node.quorum("hasrecsig", 100, id, msgHash) != hasrecsigs:
-                    return False
-                if mn.node.quorum("isconflicting", 100, id, msgHash) != isconflicting1:
-                    return False
-                if mn.node.quorum("isconflicting", 100, id, msgHashConflict) != isconflicting2:
-                    return False
+            nonlocal last_failed_node
+
+            def check_node(node):
+                # Ask all three questions in a single JSON-RPC batch request
+                return batch_rpc(node, [
+                    node.quorum.get_request("hasrecsig", 100, id, msgHash),
+                    node.quorum.get_request("isconflicting", 100, id, msgHash),
+                    node.quorum.get_request("isconflicting", 100, id, msgHashConflict),
+                ]) == [hasrecsigs, isconflicting1, isconflicting2]
+            # Short-circuit while this node is still lagging behind
+            if not check_node(last_failed_node):
+                return False
+            # Query the remaining masternodes in parallel, each of them has its own RPC connection
+            other_nodes = [node for node in mn_nodes if node is not last_failed_node]
+            with ThreadPoolExecutor(max_workers=len(other_nodes)) as executor:
+                for node, result in zip(other_nodes, executor.map(check_node, other_nodes)):
+                    if not result:
+                        last_failed_node = node
+                        return False
             return True
 
+        def sign_all(nodes, sign_id, sign_msg_hash):
+            # Signing requests are independent of each other, issue them in parallel
+            with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+                list(executor.map(lambda node: node.quorum("sign", 100, sign_id, sign_msg_hash), nodes))
+
         def wait_for_sigs(hasrecsigs, isconflicting1, isconflicting2, timeout):
-            wait_until(lambda: check_sigs(hasrecsigs, isconflicting1, isconflicting2), timeout = timeout)
+            wait_until_backoff(lambda: check_sigs(hasrecsigs, isconflicting1, isconflicting2), timeout = timeout)
 
         def assert_sigs_nochange(hasrecsigs, isconflicting1, isconflicting2, timeout):
-            assert(not wait_until(lambda: not check_sigs(hasrecsigs, isconflicting1, isconflicting2), timeout = timeout, do_assert = False))
+            assert(not wait_until_backoff(lambda: not check_sigs(hasrecsigs, isconflicting1, isconflicting2), timeout = timeout, do_assert = False))
 
         # Initial state
         wait_for_sigs(False, False, False, 1)
@@ -66,7 +103,7 @@ class LLMQSigningTest(DashTestFramework):
         assert(not self.mninfo[1].node.quorum("sign", 100, id, msgHash, msgHash))
         assert_sigs_nochange(False, False, False, 3)
         # 2. Providing a valid quorum hash should succeed and cause no changes for sigss
-        quorumHash = self.mninfo[1].node.quorum("selectquorum", 100, id)["quorumHash"]
+        quorumHash = self.select_quorum(id)["quorumHash"]
         assert(self.mninfo[1].node.quorum("sign", 100, id, msgHash, quorumHash))
         assert_sigs_nochange(False, False, False, 3)
         # Sign third share and test optional submit parameter if spork21 is enabled, should result in recovered sig
@@ -88,10 +125,10 @@ class LLMQSigningTest(DashTestFramework):
             sig_share.id = int(sig_share_rpc_1["id"], 16)
             sig_share.msgHash = int(sig_share_rpc_1["msgHash"], 16)
             sig_share.sigShare = hex_str_to_bytes(sig_share_rpc_1["signature"])
-            for mn in self.mninfo:
-                assert mn.node.getconnectioncount() == self.llmq_size
+            for mn_node in mn_nodes:
+                assert mn_node.getconnectioncount() == self.llmq_size
             # Get the current recovery member of the quorum
-            q = self.nodes[0].quorum('selectquorum', 100, id)
+            q = self.select_quorum(id)
             mn = self.get_mninfo(q['recoveryMembers'][0])
             # Open a P2P connection to it
             p2p_interface = mn.node.add_p2p_connection(P2PInterface())
@@ -131,19 +168,21 @@ class LLMQSigningTest(DashTestFramework):
 
         # Create a recovered sig for the oldest quorum i.e. the active quorum which will be moved
         # out of the active set when a new quorum appears
-        request_id = 2
+        request_id = None
         oldest_quorum_hash = node.quorum("list")["llmq_test"][-1]
-        # Search for a request id which selects the last active quorum
-        while True:
-            selected_hash = node.quorum('selectquorum', 100, uint256_to_string(request_id))["quorumHash"]
-            if selected_hash == oldest_quorum_hash:
-                break
-            else:
-                request_id += 1
+        # Search for a request id which selects the last active quorum,
+        # probing a range of ids with a single JSON-RPC batch request per round-trip
+        candidates = range(2, 12)
+        while request_id is None:
+            results = batch_rpc(node, [node.quorum.get_request('selectquorum', 100, uint256_to_string(i)) for i in candidates])
+            for candidate, result in zip(candidates, results):
+                if result["quorumHash"] == oldest_quorum_hash:
+                    request_id = candidate
+                    break
+            candidates = range(candidates.stop, candidates.stop + len(candidates))
         # Produce the recovered signature
         id = uint256_to_string(request_id)
-        for mn in self.mninfo:
-            mn.node.quorum("sign", 100, id, msgHash)
+        sign_all(mn_nodes, id, msgHash)
         # And mine a quorum to move the quorum which signed out of the active set
         self.mine_quorum()
         # Verify the recovered sig. This triggers the "signHeight + dkgInterval" verification
@@ -166,22 +205,19 @@ class LLMQSigningTest(DashTestFramework):
         # Cleanup starts every 5 seconds
         wait_for_sigs(False, False, False, 15)
 
-        for i in range(2):
-            self.mninfo[i].node.quorum("sign", 100, id, msgHashConflict)
-        for i in range(2, 5):
-            self.mninfo[i].node.quorum("sign", 100, id, msgHash)
+        sign_all(mn_nodes[:2], id, msgHashConflict)
+        sign_all(mn_nodes[2:5], id, msgHash)
         wait_for_sigs(True, False, True, 15)
 
         if self.options.spork21:
             id = uint256_to_string(request_id + 1)
 
             # Isolate the node that is responsible for the recovery of a signature and assert that recovery fails
-            q = self.nodes[0].quorum('selectquorum', 100, id)
+            q = self.select_quorum(id)
             mn = self.get_mninfo(q['recoveryMembers'][0])
             mn.node.setnetworkactive(False)
             wait_until(lambda: mn.node.getconnectioncount() == 0)
-            for i in range(4):
-                self.mninfo[i].node.quorum("sign", 100, id, msgHash)
+            sign_all(mn_nodes[:4], id, msgHash)
             assert_sigs_nochange(False, False, False, 3)
             # Need to re-connect so that it later gets the recovered sig
             mn.node.setnetworkactive(True)
@@ -7,41 +7,86 @@
 from test_framework.test_framework import BitcoinTestFramework
 from test_framework.util import *
 from struct import *
-from io import BytesIO
-from codecs import encode
+from binascii import hexlify
+from concurrent.futures import ThreadPoolExecutor
 
 import http.client
 import urllib.parse
 
-def deser_uint256(f):
-    r = 0
-    for i in range(8):
-        t = unpack(b"<I", f.read(4))[0]
-        r += t << (i * 32)
-    return r
+def first_output_index_by_value(vouts, value):
+    for vout in vouts:
+        if vout['value'] == value:
+            return vout['n']
+    raise AssertionError("No output with value %s" % value)
+
+class RESTResponse():
+    """A fully read HTTP response.
+
+    The body is read right away so that the persistent connection can be used
+    for the next request, even if the caller is only interested in the status."""
+    def __init__(self, response):
+        self.status = response.status
+        self._response = response
+        self._body = response.read()
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self):
+        return self._body
+
+def http_call(conn, method, path, requestdata=None):
+    try:
+        conn.request(method, path, requestdata)
+        return RESTResponse(conn.getresponse())
+    except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+        # the server closed the idle connection, reconnect and try again
+        conn.close()
+        conn.request(method, path, requestdata)
+        return RESTResponse(conn.getresponse())
+
+#fetches independent paths concurrently, spread over conns
+#each connection is only used by a single worker thread, responses are returned in order of paths
+def http_get_many(conns, paths):
+    def fetch_group(i):
+        return [http_call(conns[i], 'GET', path) for path in paths[i::len(conns)]]
+    with ThreadPoolExecutor(max_workers=len(conns)) as executor:
+        groups = list(executor.map(fetch_group, range(len(conns))))
+    responses = [None] * len(paths)
+    for i, group in enumerate(groups):
+        responses[i::len(conns)] = group
+    return responses
 
 #allows simple http get calls
-def http_get_call(host, port, path, response_object = 0):
-    conn = http.client.HTTPConnection(host, port)
-    conn.request('GET', path)
+def http_get_call(conn, path):
+    return http_call(conn, 'GET', path)
 
-    if response_object:
-        return conn.getresponse()
-
-    return conn.getresponse().read().decode('utf-8')
+#allows simple http get calls returning a decoded json object
+def http_get_json(conn, path, **kwargs):
+    # json.loads() accepts the raw body, no need to decode it to a str first
+    return json.loads(http_call(conn, 'GET', path).read(), **kwargs)
 
 #allows simple http post calls with a request body
-def http_post_call(host, port, path, requestdata = '', response_object = 0):
-    conn = http.client.HTTPConnection(host, port)
-    conn.request('POST', path, requestdata)
+def http_post_call(conn, path, requestdata = '', response_object = 0):
+    response = http_call(conn, 'POST', path, requestdata)
 
     if response_object:
-        return conn.getresponse()
+        return response
 
-    return conn.getresponse().read()
+    return response.read()
+
+#checks the status and the plain text message of a REST error reply
+#the body is compared as bytes, the expected messages are static so there is nothing to decode
+def assert_rest_error(response, status, message):
+    assert_equal(response.status, status)
+    assert_equal(response.read(), message + b'\r\n')
 
 class RESTTest (BitcoinTestFramework):
     FORMAT_SEPARATOR = "."
+    # Format suffixes of the REST URIs, built once instead of per call
+    JSON = FORMAT_SEPARATOR + "json"
+    BIN = FORMAT_SEPARATOR + "bin"
+    HEX = FORMAT_SEPARATOR + "hex"
 
     def set_test_params(self):
         self.setup_clean_chain = True
@@ -54,6 +99,9 @@ class RESTTest (BitcoinTestFramework):
 
     def run_test(self):
         url = urllib.parse.urlparse(self.nodes[0].url)
+        # All REST calls share a few persistent connections, conn is used for sequential calls
+        conns = [http.client.HTTPConnection(url.hostname, url.port) for _ in range(4)]
+        conn = conns[0]
         self.log.info("Mining blocks...")
 
         self.nodes[0].generate(1)
@@ -65,29 +113,24 @@ class RESTTest (BitcoinTestFramework):
 
         txid = self.nodes[0].sendtoaddress(self.nodes[1].getnewaddress(), 0.1)
         self.sync_all()
-        self.nodes[2].generate(1)
+        # the best block hash only changes when blocks are generated, take it from generate instead of asking again
+        bb_hash = self.nodes[2].generate(1)[0]
         self.sync_all()
-        bb_hash = self.nodes[0].getbestblockhash()
 
         assert_equal(self.nodes[1].getbalance(), Decimal("0.1")) #balance now should be 0.1 on node 1
 
         # load the latest 0.1 tx over the REST API
-        json_string = http_get_call(url.hostname, url.port, '/rest/tx/'+txid+self.FORMAT_SEPARATOR+"json")
-        json_obj = json.loads(json_string)
+        json_obj = http_get_json(conn, '/rest/tx/'+txid+self.JSON)
         vintx = json_obj['vin'][0]['txid'] # get the vin to later check for utxo (should be spent by then)
         # get n of 0.1 outpoint
-        n = 0
-        for vout in json_obj['vout']:
-            if vout['value'] == 0.1:
-                n = vout['n']
+        n = first_output_index_by_value(json_obj['vout'], 0.1)
 
 
         #######################################
         # GETUTXOS: query an unspent outpoint #
         #######################################
         json_request = '/'+txid+'-'+str(n)
-        json_string = http_get_call(url.hostname, url.port, '/rest/getutxos'+json_request+self.FORMAT_SEPARATOR+'json')
-        json_obj = json.loads(json_string)
+        json_obj = http_get_json(conn, '/rest/getutxos'+json_request+self.JSON)
 
         #check chainTip response
         assert_equal(json_obj['chaintipHash'], bb_hash)
@@ -101,8 +144,7 @@ class RESTTest (BitcoinTestFramework):
         # GETUTXOS: now query an already spent outpoint #
         #################################################
         json_request = '/'+vintx+'-0'
-        json_string = http_get_call(url.hostname, url.port, '/rest/getutxos'+json_request+self.FORMAT_SEPARATOR+'json')
-        json_obj = json.loads(json_string)
+        json_obj = http_get_json(conn, '/rest/getutxos'+json_request+self.JSON)
 
         #check chainTip response
         assert_equal(json_obj['chaintipHash'], bb_hash)
@@ -118,28 +160,22 @@ class RESTTest (BitcoinTestFramework):
         # GETUTXOS: now check both with the same request #
         ##################################################
         json_request = '/'+txid+'-'+str(n)+'/'+vintx+'-0'
-        json_string = http_get_call(url.hostname, url.port, '/rest/getutxos'+json_request+self.FORMAT_SEPARATOR+'json')
-        json_obj = json.loads(json_string)
+        json_obj = http_get_json(conn, '/rest/getutxos'+json_request+self.JSON)
         assert_equal(len(json_obj['utxos']), 1)
         assert_equal(json_obj['bitmap'], "10")
 
         #test binary response
-        bb_hash = self.nodes[0].getbestblockhash()
-
-        binaryRequest = b'\x01\x02'
-        binaryRequest += hex_str_to_bytes(txid)
-        binaryRequest += pack("i", n)
-        binaryRequest += hex_str_to_bytes(vintx)
-        binaryRequest += pack("i", 0)
-
-        bin_response = http_post_call(url.hostname, url.port, '/rest/getutxos'+self.FORMAT_SEPARATOR+'bin', binaryRequest)
-        output = BytesIO()
-        output.write(bin_response)
-        output.seek(0)
-        chainHeight = unpack("i", output.read(4))[0]
-        hashFromBinResponse = hex(deser_uint256(output))[2:].zfill(64)
-
-        assert_equal(bb_hash, hashFromBinResponse) #check if getutxo's chaintip during calculation was fine
+        binaryRequest = b''.join([
+            b'\x01\x02',
+            hex_str_to_bytes(txid), pack("<i", n),
+            hex_str_to_bytes(vintx), pack("<i", 0),
+        ])
+
+        bin_response = http_post_call(conn, '/rest/getutxos'+self.BIN, binaryRequest)
+        chainHeight, hashFromBinResponse = unpack("<i32s", bin_response[:36])
+
+        # the hash is serialized little endian, compare the raw bytes instead of hex encoding them
+        assert_equal(hex_str_to_bytes(bb_hash)[::-1], hashFromBinResponse) #check if getutxo's chaintip during calculation was fine
         assert_equal(chainHeight, 102) #chain height must be 102
 
 
@@ -149,75 +185,59 @@ class RESTTest (BitcoinTestFramework):
 
         # do a tx and don't sync
         txid = self.nodes[0].sendtoaddress(self.nodes[1].getnewaddress(), 0.1)
-        json_string = http_get_call(url.hostname, url.port, '/rest/tx/'+txid+self.FORMAT_SEPARATOR+"json")
-        json_obj = json.loads(json_string)
+        json_obj = http_get_json(conn, '/rest/tx/'+txid+self.JSON)
         # get the spent output to later check for utxo (should be spent by then)
         spent = '{}-{}'.format(json_obj['vin'][0]['txid'], json_obj['vin'][0]['vout'])
         # get n of 0.1 outpoint
-        n = 0
-        for vout in json_obj['vout']:
-            if vout['value'] == 0.1:
-                n = vout['n']
+        n = first_output_index_by_value(json_obj['vout'], 0.1)
         spending = '{}-{}'.format(txid, n)
 
-        json_request = '/'+spending
-        json_string = http_get_call(url.hostname, url.port, '/rest/getutxos'+json_request+self.FORMAT_SEPARATOR+'json')
-        json_obj = json.loads(json_string)
-        assert_equal(len(json_obj['utxos']), 0) #there should be no outpoint because it has just added to the mempool
-
-        json_request = '/checkmempool/'+spending
-        json_string = http_get_call(url.hostname, url.port, '/rest/getutxos'+json_request+self.FORMAT_SEPARATOR+'json')
-        json_obj = json.loads(json_string)
-        assert_equal(len(json_obj['utxos']), 1) #there should be an outpoint because it has just added to the mempool
-
-        json_request = '/'+spent
-        json_string = http_get_call(url.hostname, url.port, '/rest/getutxos'+json_request+self.FORMAT_SEPARATOR+'json')
-        json_obj = json.loads(json_string)
-        assert_equal(len(json_obj['utxos']), 1) #there should be an outpoint because its spending tx is not confirmed
+        # query both outpoints at once, the bitmap has one '0'/'1' digit per requested outpoint (in request order)
+        json_request = '/'+spending+'/'+spent
+        json_obj = http_get_json(conn, '/rest/getutxos'+json_request+self.JSON)
+        assert_equal(len(json_obj['utxos']), 1)
+        # spending: there should be no outpoint because it has just added to the mempool
+        # spent: there should be an outpoint because its spending tx is not confirmed
+        assert_equal(json_obj['bitmap'], "01")
 
-        json_request = '/checkmempool/'+spent
-        json_string = http_get_call(url.hostname, url.port, '/rest/getutxos'+json_request+self.FORMAT_SEPARATOR+'json')
-        json_obj = json.loads(json_string)
-        assert_equal(len(json_obj['utxos']), 0) #there should be no outpoint because it has just spent (by mempool tx)
+        json_request = '/checkmempool/'+spending+'/'+spent
+        json_obj = http_get_json(conn, '/rest/getutxos'+json_request+self.JSON)
+        assert_equal(len(json_obj['utxos']), 1)
+        # spending: there should be an outpoint because it has just added to the mempool
+        # spent: there should be no outpoint because it has just spent (by mempool tx)
+        assert_equal(json_obj['bitmap'], "10")
 
         self.nodes[0].generate(1)
         self.sync_all()
 
         json_request = '/'+spending
-        json_string = http_get_call(url.hostname, url.port, '/rest/getutxos'+json_request+self.FORMAT_SEPARATOR+'json')
-        json_obj = json.loads(json_string)
+        json_obj = http_get_json(conn, '/rest/getutxos'+json_request+self.JSON)
         assert_equal(len(json_obj['utxos']), 1) #there should be an outpoint because it was mined
 
         json_request = '/checkmempool/'+spending
-        json_string = http_get_call(url.hostname, url.port, '/rest/getutxos'+json_request+self.FORMAT_SEPARATOR+'json')
-        json_obj = json.loads(json_string)
+        json_obj = http_get_json(conn, '/rest/getutxos'+json_request+self.JSON)
         assert_equal(len(json_obj['utxos']), 1) #there should be an outpoint because it was mined
 
         #do some invalid requests
         json_request = '{"checkmempool'
-        response = http_post_call(url.hostname, url.port, '/rest/getutxos'+self.FORMAT_SEPARATOR+'json', json_request, True)
-        assert_equal(response.status, 400) #must be a 400 because we send an invalid json request
+        response = http_post_call(conn, '/rest/getutxos'+self.JSON, json_request, True)
+        assert_rest_error(response, 400, b'Error: empty request') #must be a 400 because we send an invalid json request
 
         json_request = '{"checkmempool'
-        response = http_post_call(url.hostname, url.port, '/rest/getutxos'+self.FORMAT_SEPARATOR+'bin', json_request, True)
-        assert_equal(response.status, 400) #must be a 400 because we send an invalid bin request
+        response = http_post_call(conn, '/rest/getutxos'+self.BIN, json_request, True)
+        assert_rest_error(response, 400, b'Parse error') #must be a 400 because we send an invalid bin request
 
-        response = http_post_call(url.hostname, url.port, '/rest/getutxos/checkmempool'+self.FORMAT_SEPARATOR+'bin', '', True)
-        assert_equal(response.status, 400) #must be a 400 because we send an invalid bin request
+        response = http_post_call(conn, '/rest/getutxos/checkmempool'+self.BIN, '', True)
+        assert_rest_error(response, 400, b'Error: empty request') #must be a 400 because we send an invalid bin request
 
         #test limits
-        json_request = '/checkmempool/'
-        for x in range(0, 20):
-            json_request += txid+'-'+str(n)+'/'
-        json_request = json_request.rstrip("/")
-        response = http_post_call(url.hostname, url.port, '/rest/getutxos'+json_request+self.FORMAT_SEPARATOR+'json', '', True)
-        assert_equal(response.status, 400) #must be a 400 because we exceeding the limits
-
-        json_request = '/checkmempool/'
-        for x in range(0, 15):
-            json_request += txid+'-'+str(n)+'/'
-        json_request = json_request.rstrip("/")
-        response = http_post_call(url.hostname, url.port, '/rest/getutxos'+json_request+self.FORMAT_SEPARATOR+'json', '', True)
+        outpoints = [spending] * 20
+        json_request = '/checkmempool/' + '/'.join(outpoints)
+        response = http_post_call(conn, '/rest/getutxos'+json_request+self.JSON, '', True)
+        assert_rest_error(response, 400, b'Error: max outpoints exceeded (max: 15, tried: 20)') #must be a 400 because we exceeding the limits
+
+        json_request = '/checkmempool/' + '/'.join(outpoints[:15])
+        response = http_post_call(conn, '/rest/getutxos'+json_request+self.JSON, '', True)
         assert_equal(response.status, 200) #must be a 200 because we are within the limits
 
         self.nodes[0].generate(1) #generate block to not affect upcoming tests
@@ -227,44 +247,54 @@ class RESTTest (BitcoinTestFramework):
         # /rest/block/ #
         ################
 
+        block_uri = '/rest/block/'+bb_hash
+        header_uri = '/rest/headers/1/'+bb_hash
+
+        # all requests below are independent reads, fetch them concurrently
+        response, response_header, response_hex, response_header_hex, block_json_response, response_header_json = \
+            http_get_many(conns, [
+                block_uri+self.BIN,
+                header_uri+self.BIN,
+                block_uri+self.HEX,
+                header_uri+self.HEX,
+                block_uri+self.JSON,
+                header_uri+self.JSON,
+            ])
+
         # check binary format
-        response = http_get_call(url.hostname, url.port, '/rest/block/'+bb_hash+self.FORMAT_SEPARATOR+"bin", True)
         assert_equal(response.status, 200)
         assert_greater_than(int(response.getheader('content-length')), 80)
         response_str = response.read()
 
         # compare with block header
-        response_header = http_get_call(url.hostname, url.port, '/rest/headers/1/'+bb_hash+self.FORMAT_SEPARATOR+"bin", True)
         assert_equal(response_header.status, 200)
         assert_equal(int(response_header.getheader('content-length')), 80)
         response_header_str = response_header.read()
         assert_equal(response_str[0:80], response_header_str)
+        # the header is a prefix of the block, so its hex is all we need for the hex comparisons below
+        header_hex = hexlify(response_header_str)
 
         # check block hex format
-        response_hex = http_get_call(url.hostname, url.port, '/rest/block/'+bb_hash+self.FORMAT_SEPARATOR+"hex", True)
         assert_equal(response_hex.status, 200)
         assert_greater_than(int(response_hex.getheader('content-length')), 160)
         response_hex_str = response_hex.read()
-        assert_equal(encode(response_str, "hex_codec")[0:160], response_hex_str[0:160])
+        assert_equal(header_hex, response_hex_str[0:160])
 
         # compare with hex block header
-        response_header_hex = http_get_call(url.hostname, url.port, '/rest/headers/1/'+bb_hash+self.FORMAT_SEPARATOR+"hex", True)
         assert_equal(response_header_hex.status, 200)
         assert_greater_than(int(response_header_hex.getheader('content-length')), 160)
         response_header_hex_str = response_header_hex.read()
         assert_equal(response_hex_str[0:160], response_header_hex_str[0:160])
-        assert_equal(encode(response_header_str, "hex_codec")[0:160], response_header_hex_str[0:160])
+        assert_equal(header_hex, response_header_hex_str[0:160])
 
         # check json format
-        block_json_string = http_get_call(url.hostname, url.port, '/rest/block/'+bb_hash+self.FORMAT_SEPARATOR+'json')
-        block_json_obj = json.loads(block_json_string)
+        assert_equal(block_json_response.status, 200)
+        block_json_obj = json.loads(block_json_response.read())
         assert_equal(block_json_obj['hash'], bb_hash)
 
         # compare with json block header
-        response_header_json = http_get_call(url.hostname, url.port, '/rest/headers/1/'+bb_hash+self.FORMAT_SEPARATOR+"json", True)
         assert_equal(response_header_json.status, 200)
-        response_header_json_str = response_header_json.read().decode('utf-8')
-        json_obj = json.loads(response_header_json_str, parse_float=Decimal)
+        json_obj = json.loads(response_header_json.read(), parse_float=Decimal)
         assert_equal(len(json_obj), 1) #ensure that there is one header in the json response
         assert_equal(json_obj[0]['hash'], bb_hash) #request/response hash should be the same
 
@@ -285,42 +315,37 @@ class RESTTest (BitcoinTestFramework):
         #see if we can get 5 headers in one response
         self.nodes[1].generate(5)
         self.sync_all()
-        response_header_json = http_get_call(url.hostname, url.port, '/rest/headers/5/'+bb_hash+self.FORMAT_SEPARATOR+"json", True)
+        response_header_json = http_get_call(conn, '/rest/headers/5/'+bb_hash+self.JSON)
         assert_equal(response_header_json.status, 200)
-        response_header_json_str = response_header_json.read().decode('utf-8')
-        json_obj = json.loads(response_header_json_str)
+        json_obj = json.loads(response_header_json.read())
         assert_equal(len(json_obj), 5) #now we should have 5 header objects
 
         # do tx test
         tx_hash = block_json_obj['tx'][0]['txid']
-        json_string = http_get_call(url.hostname, url.port, '/rest/tx/'+tx_hash+self.FORMAT_SEPARATOR+"json")
-        json_obj = json.loads(json_string)
+        json_obj = http_get_json(conn, '/rest/tx/'+tx_hash+self.JSON)
         assert_equal(json_obj['txid'], tx_hash)
 
         # check hex format response
-        hex_string = http_get_call(url.hostname, url.port, '/rest/tx/'+tx_hash+self.FORMAT_SEPARATOR+"hex", True)
+        hex_string = http_get_call(conn, '/rest/tx/'+tx_hash+self.HEX)
         assert_equal(hex_string.status, 200)
         assert_greater_than(int(response.getheader('content-length')), 10)
 
 
         # check block tx details
         # let's make 3 tx and mine them on node 1
-        txs = []
-        txs.append(self.nodes[0].sendtoaddress(self.nodes[2].getnewaddress(), 11))
-        txs.append(self.nodes[0].sendtoaddress(self.nodes[2].getnewaddress(), 11))
-        txs.append(self.nodes[0].sendtoaddress(self.nodes[2].getnewaddress(), 11))
+        # a batch is executed in order, so each tx still spends the change of the previous one
+        addresses = batch_rpc(self.nodes[2], [self.nodes[2].getnewaddress.get_request() for _ in range(3)])
+        txs = batch_rpc(self.nodes[0], [self.nodes[0].sendtoaddress.get_request(address, 11) for address in addresses])
         self.sync_all()
 
         # check that there are exactly 3 transactions in the TX memory pool before generating the block
-        json_string = http_get_call(url.hostname, url.port, '/rest/mempool/info'+self.FORMAT_SEPARATOR+'json')
-        json_obj = json.loads(json_string)
+        json_obj = http_get_json(conn, '/rest/mempool/info'+self.JSON)
         assert_equal(json_obj['size'], 3)
         # the size of the memory pool should be greater than 3x ~100 bytes
         assert_greater_than(json_obj['bytes'], 300)
 
         # check that there are our submitted transactions in the TX memory pool
-        json_string = http_get_call(url.hostname, url.port, '/rest/mempool/contents'+self.FORMAT_SEPARATOR+'json')
-        json_obj = json.loads(json_string)
+        json_obj = http_get_json(conn, '/rest/mempool/contents'+self.JSON)
         for i, tx in enumerate(txs):
             assert_equal(tx in json_obj, True)
             assert_equal(json_obj[tx]['spentby'], txs[i+1:i+2])
@@ -331,24 +356,25 @@ class RESTTest (BitcoinTestFramework):
         self.sync_all()
 
         #check if the 3 tx show up in the new block
-        json_string = http_get_call(url.hostname, url.port, '/rest/block/'+newblockhash[0]+self.FORMAT_SEPARATOR+'json')
-        json_obj = json.loads(json_string)
-        for tx in json_obj['tx']:
-            if not 'coinbase' in tx['vin'][0]: #exclude coinbase
-                assert_equal(tx['txid'] in txs, True)
+        json_obj = http_get_json(conn, '/rest/block/'+newblockhash[0]+self.JSON)
+        # the coinbase is always the first tx of a block, no need to probe the vins of every tx for it
+        coinbase_tx, *block_txs = json_obj['tx']
+        assert 'coinbase' in coinbase_tx['vin'][0]
+        # each tx spends the previous one, so they have to be in the block in the order they were sent
+        assert_equal([tx['txid'] for tx in block_txs], txs)
 
         #check the same but without tx details
-        json_string = http_get_call(url.hostname, url.port, '/rest/block/notxdetails/'+newblockhash[0]+self.FORMAT_SEPARATOR+'json')
-        json_obj = json.loads(json_string)
-        for tx in txs:
-            assert_equal(tx in json_obj['tx'], True)
+        json_obj = http_get_json(conn, '/rest/block/notxdetails/'+newblockhash[0]+self.JSON)
+        assert_equal(json_obj['tx'][1:], txs)
 
         #test rest bestblock
-        bb_hash = self.nodes[0].getbestblockhash()
+        bb_hash = newblockhash[0]
 
-        json_string = http_get_call(url.hostname, url.port, '/rest/chaininfo.json')
-        json_obj = json.loads(json_string)
+        json_obj = http_get_json(conn, '/rest/chaininfo'+self.JSON)
         assert_equal(json_obj['bestblockhash'], bb_hash)
 
+        for c in conns:
+            c.close()
+
 if __name__ == '__main__':
     RESTTest ().main ()
@@ -24,8 +24,7 @@ class ZMQSubscriber:
         self.socket = socket
         self.topic = topic
 
-        import zmq
-        self.socket.setsockopt(zmq.SUBSCRIBE, self.topic)
+        self.socket.subscribe(self.topic)
 
     def receive(self):
         topic, body, seq = self.socket.recv_multipart()
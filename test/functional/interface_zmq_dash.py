@@ -5,10 +5,11 @@
 """Test the dash specific ZMQ notification interfaces."""
 
 import configparser
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 import io
 import json
-import random
+import secrets
 import struct
 import time
 try:
@@ -57,32 +58,38 @@ class ZMQPublisher(Enum):
     raw_recovered_sig = "rawrecoveredsig"
 
 
+# Encoded topics of all publishers, that's what's sent in the first frame of a ZMQ message
+ZMQ_TOPICS = {pub: pub.value.encode() for pub in ZMQPublisher}
+# The request id of a ChainLock's recovered sig is hash256(CLSIG_REQUEST_ID_PREFIX + height)
+CLSIG_REQUEST_ID_PREFIX = ser_string(b"clsig")
+
+
 class TestP2PConn(P2PInterface):
     def __init__(self):
         super().__init__()
-        self.islocks = {}
-        self.txes = {}
+        # islocks and txes we announced, by hash. Both are announced with the same inv type, so
+        # getdata requests can be answered with a single lookup.
+        self.objects = {}
 
     def send_islock(self, islock):
         hash = uint256_from_str(hash256(islock.serialize()))
-        self.islocks[hash] = islock
+        self.objects[hash] = islock
 
         inv = msg_inv([CInv(30, hash)])
         self.send_message(inv)
 
     def send_tx(self, tx):
         hash = uint256_from_str(hash256(tx.serialize()))
-        self.txes[hash] = tx
+        self.objects[hash] = tx
 
         inv = msg_inv([CInv(30, hash)])
         self.send_message(inv)
 
     def on_getdata(self, message):
         for inv in message.inv:
-            if inv.hash in self.islocks:
-                self.send_message(self.islocks[inv.hash])
-            if inv.hash in self.txes:
-                self.send_message(self.txes[inv.hash])
+            obj = self.objects.get(inv.hash)
+            if obj is not None:
+                self.send_message(obj)
 
 
 class DashZMQTest (DashTestFramework):
@@ -113,14 +120,19 @@ class DashZMQTest (DashTestFramework):
             self.activate_dip8()
             self.nodes[0].spork("SPORK_17_QUORUM_DKG_ENABLED", 0)
             self.wait_for_sporks_same()
+            # The recovered sig of the ChainLock for the tip is published after the ChainLock itself, it would be
+            # received in the recovered sig test otherwise which leads to test failure. Subscribe before any of
+            # them can be sent and drain the notifications up to the one for the tip.
+            self.subscribe([ZMQPublisher.hash_recovered_sig])
             # Create an LLMQ for testing
             self.quorum_type = 100  # llmq_test
             self.quorum_hash = self.mine_quorum()
             self.sync_blocks()
-            self.wait_for_chainlocked_block_all_nodes(self.nodes[0].getbestblockhash())
-            # Wait a moment to avoid subscribing to recovered sig in the test before the one from the chainlock
-            # has been sent which leads to test failure.
-            time.sleep(1)
+            tip_hash = self.nodes[0].getbestblockhash()
+            self.wait_for_chainlocked_block_all_nodes(tip_hash)
+            while self.receive_hash(ZMQPublisher.hash_recovered_sig) != tip_hash:
+                pass
+            self.unsubscribe([ZMQPublisher.hash_recovered_sig])
             # Test all dash related ZMQ publisher
             self.test_recovered_signature_publishers()
             self.test_chainlock_publishers()
@@ -134,19 +146,33 @@ class DashZMQTest (DashTestFramework):
     def subscribe(self, publishers):
         # Subscribe to a list of ZMQPublishers
         for pub in publishers:
-            self.socket.subscribe(pub.value)
+            self.socket.subscribe(ZMQ_TOPICS[pub])
 
     def unsubscribe(self, publishers):
         # Unsubscribe from a list of ZMQPublishers
         for pub in publishers:
-            self.socket.unsubscribe(pub.value)
+            self.socket.unsubscribe(ZMQ_TOPICS[pub])
 
-    def receive(self, publisher, flags=0):
+    def receive_body(self, publisher, flags=0):
         # Receive a ZMQ message and validate it's sent from the correct ZMQPublisher
         topic, body, seq = self.socket.recv_multipart(flags)
         # Topic should match the publisher value
-        assert_equal(topic.decode(), publisher.value)
-        return io.BytesIO(body)
+        assert_equal(topic, ZMQ_TOPICS[publisher])
+        return body
+
+    def receive(self, publisher, flags=0):
+        # Receive a ZMQ message as stream to deserialize it
+        return io.BytesIO(self.receive_body(publisher, flags))
+
+    def receive_obj(self, publisher, cls):
+        # Receive a raw* ZMQ message and deserialize it into a new cls object
+        obj = cls()
+        obj.deserialize(self.receive(publisher))
+        return obj
+
+    def receive_hash(self, publisher):
+        # Receive a hash* ZMQ message, its body is just the hash so it's converted to hex directly
+        return bytes_to_hex_str(self.receive_body(publisher))
 
     def test_recovered_signature_publishers(self):
 
@@ -154,11 +180,10 @@ class DashZMQTest (DashTestFramework):
             # Make sure the recovered sig exists by RPC
             rpc_recovered_sig = self.get_recovered_sig(request_id, msg_hash)
             # Validate hashrecoveredsig
-            zmq_recovered_sig_hash = bytes_to_hex_str(self.receive(ZMQPublisher.hash_recovered_sig).read(32))
+            zmq_recovered_sig_hash = self.receive_hash(ZMQPublisher.hash_recovered_sig)
             assert_equal(zmq_recovered_sig_hash, msg_hash)
             # Validate rawrecoveredsig
-            zmq_recovered_sig_raw = CRecoveredSig()
-            zmq_recovered_sig_raw.deserialize(self.receive(ZMQPublisher.raw_recovered_sig))
+            zmq_recovered_sig_raw = self.receive_obj(ZMQPublisher.raw_recovered_sig, CRecoveredSig)
             assert_equal(zmq_recovered_sig_raw.llmqType, rpc_recovered_sig['llmqType'])
             assert_equal(uint256_to_string(zmq_recovered_sig_raw.quorumHash), rpc_recovered_sig['quorumHash'])
             assert_equal(uint256_to_string(zmq_recovered_sig_raw.id), rpc_recovered_sig['id'])
@@ -176,13 +201,15 @@ class DashZMQTest (DashTestFramework):
         rpc_last_block_hash = self.nodes[0].generate(1)[0]
         self.wait_for_chainlocked_block_all_nodes(rpc_last_block_hash)
         height = self.nodes[0].getblockcount()
-        rpc_request_id = hash256(ser_string(b"clsig") + struct.pack("<I", height))[::-1].hex()
+        rpc_request_id = hash256(CLSIG_REQUEST_ID_PREFIX + struct.pack("<I", height))[::-1].hex()
         validate_recovered_sig(rpc_request_id, rpc_last_block_hash)
         # Sign an arbitrary and make sure this leads to valid recovered sig ZMQ messages
-        sign_id = uint256_to_string(random.getrandbits(256))
-        sign_msg_hash = uint256_to_string(random.getrandbits(256))
-        for mn in self.get_quorum_masternodes(self.quorum_hash):
-            mn.node.quorum("sign", self.quorum_type, sign_id, sign_msg_hash)
+        sign_id = secrets.token_hex(32)
+        sign_msg_hash = secrets.token_hex(32)
+        # The sign requests are independent, send them to all quorum members at once
+        quorum_mns = self.get_quorum_masternodes(self.quorum_hash)
+        with ThreadPoolExecutor(max_workers=len(quorum_mns)) as executor:
+            list(executor.map(lambda mn: mn.node.quorum("sign", self.quorum_type, sign_id, sign_msg_hash), quorum_mns))
         validate_recovered_sig(sign_id, sign_msg_hash)
         # Unsubscribe from recovered signature messages
         self.unsubscribe(recovered_sig_publishers)
@@ -208,11 +235,10 @@ class DashZMQTest (DashTestFramework):
         rpc_chain_lock_hash = rpc_chain_locked_block["hash"]
         assert_equal(generated_hash, rpc_chain_lock_hash)
         # Validate hashchainlock
-        zmq_chain_lock_hash = bytes_to_hex_str(self.receive(ZMQPublisher.hash_chain_lock).read(32))
+        zmq_chain_lock_hash = self.receive_hash(ZMQPublisher.hash_chain_lock)
         assert_equal(zmq_chain_lock_hash, rpc_best_chain_lock_hash)
         # Validate rawchainlock
-        zmq_chain_locked_block = CBlock()
-        zmq_chain_locked_block.deserialize(self.receive(ZMQPublisher.raw_chain_lock))
+        zmq_chain_locked_block = self.receive_obj(ZMQPublisher.raw_chain_lock, CBlock)
         assert(zmq_chain_locked_block.is_valid())
         assert_equal(zmq_chain_locked_block.hash, rpc_chain_lock_hash)
         # Validate rawchainlocksig
@@ -253,11 +279,10 @@ class DashZMQTest (DashTestFramework):
         rpc_raw_tx_1_hash = self.nodes[0].sendrawtransaction(rpc_raw_tx_1['hex'])
         self.wait_for_instantlock(rpc_raw_tx_1_hash, self.nodes[0])
         # Validate hashtxlock
-        zmq_tx_lock_hash = bytes_to_hex_str(self.receive(ZMQPublisher.hash_tx_lock).read(32))
+        zmq_tx_lock_hash = self.receive_hash(ZMQPublisher.hash_tx_lock)
         assert_equal(zmq_tx_lock_hash, rpc_raw_tx_1['txid'])
         # Validate rawtxlock
-        zmq_tx_lock_raw = CTransaction()
-        zmq_tx_lock_raw.deserialize(self.receive(ZMQPublisher.raw_tx_lock))
+        zmq_tx_lock_raw = self.receive_obj(ZMQPublisher.raw_tx_lock, CTransaction)
         assert(zmq_tx_lock_raw.is_valid())
         assert_equal(zmq_tx_lock_raw.hash, rpc_raw_tx_1['txid'])
         # Validate rawtxlocksig
@@ -273,17 +298,15 @@ class DashZMQTest (DashTestFramework):
         # which already got the InstantSend lock.
         assert_raises_rpc_error(-26, "tx-txlock-conflict", self.nodes[0].sendrawtransaction, rpc_raw_tx_2['hex'])
         # Validate hashinstantsenddoublespend
-        zmq_double_spend_hash2 = bytes_to_hex_str(self.receive(ZMQPublisher.hash_instantsend_doublespend).read(32))
-        zmq_double_spend_hash1 = bytes_to_hex_str(self.receive(ZMQPublisher.hash_instantsend_doublespend).read(32))
+        zmq_double_spend_hash2 = self.receive_hash(ZMQPublisher.hash_instantsend_doublespend)
+        zmq_double_spend_hash1 = self.receive_hash(ZMQPublisher.hash_instantsend_doublespend)
         assert_equal(zmq_double_spend_hash2, rpc_raw_tx_2['txid'])
         assert_equal(zmq_double_spend_hash1, rpc_raw_tx_1['txid'])
         # Validate rawinstantsenddoublespend
-        zmq_double_spend_tx_2 = CTransaction()
-        zmq_double_spend_tx_2.deserialize(self.receive(ZMQPublisher.raw_instantsend_doublespend))
+        zmq_double_spend_tx_2 = self.receive_obj(ZMQPublisher.raw_instantsend_doublespend, CTransaction)
         assert (zmq_double_spend_tx_2.is_valid())
         assert_equal(zmq_double_spend_tx_2.hash, rpc_raw_tx_2['txid'])
-        zmq_double_spend_tx_1 = CTransaction()
-        zmq_double_spend_tx_1.deserialize(self.receive(ZMQPublisher.raw_instantsend_doublespend))
+        zmq_double_spend_tx_1 = self.receive_obj(ZMQPublisher.raw_instantsend_doublespend, CTransaction)
         assert(zmq_double_spend_tx_1.is_valid())
         assert_equal(zmq_double_spend_tx_1.hash, rpc_raw_tx_1['txid'])
         # No islock notifications when tx is not received yet
@@ -303,7 +326,7 @@ class DashZMQTest (DashTestFramework):
         self.test_node.send_tx(FromHex(msg_tx(), rpc_raw_tx_3['hex']))
         self.wait_for_instantlock(rpc_raw_tx_3['txid'], self.nodes[0])
         # Validate hashtxlock
-        zmq_tx_lock_hash = bytes_to_hex_str(self.receive(ZMQPublisher.hash_tx_lock).read(32))
+        zmq_tx_lock_hash = self.receive_hash(ZMQPublisher.hash_tx_lock)
         assert_equal(zmq_tx_lock_hash, rpc_raw_tx_3['txid'])
         # Drop test node connection
         self.nodes[0].disconnect_p2ps()
@@ -332,17 +355,16 @@ class DashZMQTest (DashTestFramework):
             "payment_address": self.nodes[0].getnewaddress(),
             "url": "https://dash.org"
         }
-        proposal_hex = ''.join(format(x, '02x') for x in json.dumps(proposal_data).encode())
+        proposal_hex = json.dumps(proposal_data).encode().hex()
         collateral = self.nodes[0].gobject("prepare", "0", proposal_rev, proposal_time, proposal_hex)
         self.wait_for_instantlock(collateral, self.nodes[0])
         self.nodes[0].generate(6)
         self.sync_blocks()
         rpc_proposal_hash = self.nodes[0].gobject("submit", "0", proposal_rev, proposal_time, proposal_hex, collateral)
         # Validate hashgovernanceobject
-        zmq_governance_object_hash = bytes_to_hex_str(self.receive(ZMQPublisher.hash_governance_object).read(32))
+        zmq_governance_object_hash = self.receive_hash(ZMQPublisher.hash_governance_object)
         assert_equal(zmq_governance_object_hash, rpc_proposal_hash)
-        zmq_governance_object_raw = CGovernanceObject()
-        zmq_governance_object_raw.deserialize(self.receive(ZMQPublisher.raw_governance_object))
+        zmq_governance_object_raw = self.receive_obj(ZMQPublisher.raw_governance_object, CGovernanceObject)
         assert_equal(zmq_governance_object_raw.nHashParent, 0)
         assert_equal(zmq_governance_object_raw.nRevision, proposal_rev)
         assert_equal(zmq_governance_object_raw.nTime, proposal_time)
@@ -367,11 +389,10 @@ class DashZMQTest (DashTestFramework):
         self.nodes[0].gobject("vote-many", rpc_proposal_hash, map_vote_signals[1], map_vote_outcomes[1])
         rpc_proposal_votes = self.nodes[0].gobject('getcurrentvotes', rpc_proposal_hash)
         # Validate hashgovernancevote
-        zmq_governance_vote_hash = bytes_to_hex_str(self.receive(ZMQPublisher.hash_governance_vote).read(32))
+        zmq_governance_vote_hash = self.receive_hash(ZMQPublisher.hash_governance_vote)
         assert(zmq_governance_vote_hash in rpc_proposal_votes)
         # Validate rawgovernancevote
-        zmq_governance_vote_raw = CGovernanceVote()
-        zmq_governance_vote_raw.deserialize(self.receive(ZMQPublisher.raw_governance_vote))
+        zmq_governance_vote_raw = self.receive_obj(ZMQPublisher.raw_governance_vote, CGovernanceVote)
         assert_equal(uint256_to_string(zmq_governance_vote_raw.nParentHash), rpc_proposal_hash)
         rpc_vote_parts = rpc_proposal_votes[zmq_governance_vote_hash].split(':')
         rpc_outpoint_parts = rpc_vote_parts[0].split('-')
@@ -21,13 +21,15 @@ class MempoolPackagesTest(BitcoinTestFramework):
     def chain_transaction(self, node, parent_txid, vout, value, fee, num_outputs):
         send_value = satoshi_round((value - fee)/num_outputs)
         inputs = [ {'txid' : parent_txid, 'vout' : vout} ]
-        outputs = {}
-        for i in range(num_outputs):
-            outputs[node.getnewaddress()] = send_value
+        addresses = batch_rpc(node, [node.getnewaddress.get_request() for _ in range(num_outputs)])
+        outputs = {address: send_value for address in addresses}
         rawtx = node.createrawtransaction(inputs, outputs)
         signedtx = node.signrawtransactionwithwallet(rawtx)
-        txid = node.sendrawtransaction(signedtx['hex'])
-        fulltx = node.getrawtransaction(txid, 1)
+        # decoding doesn't depend on the tx being accepted, so it can share the round-trip with sending it
+        txid, fulltx = batch_rpc(node, [
+            node.sendrawtransaction.get_request(signedtx['hex']),
+            node.decoderawtransaction.get_request(signedtx['hex']),
+        ])
         assert(len(fulltx['vout']) == num_outputs) # make sure we didn't generate a change output
         return (txid, send_value)
 
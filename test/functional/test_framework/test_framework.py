@@ -33,6 +33,7 @@ from .util import (
     PortSeed,
     MAX_NODES,
     assert_equal,
+    batch_rpc,
     check_json_precision,
     connect_nodes_bi,
     connect_nodes,
@@ -49,6 +50,7 @@ from .util import (
     sync_blocks,
     sync_mempools,
     wait_until,
+    wait_until_backoff,
     get_chain_folder,
 )
 
@@ -747,9 +749,15 @@ class DashTestFramework(BitcoinTestFramework):
 
     def create_raw_tx(self, node_from, node_to, amount, min_inputs, max_inputs):
         assert (min_inputs <= max_inputs)
+        # the wallet queries below don't depend on each other, send them to node_from in a single batch
+        requests = [node_from.listunspent.get_request(), node_from.getnewaddress.get_request()]
+        if node_to is node_from:
+            requests.append(node_from.getnewaddress.get_request())
+        results = batch_rpc(node_from, requests)
+        balances, change_address = results[0], results[1]
+        receiver_address = results[2] if node_to is node_from else node_to.getnewaddress()
         # fill inputs
         inputs = []
-        balances = node_from.listunspent()
         in_amount = 0.0
         last_amount = 0.0
         for tx in balances:
@@ -780,8 +788,6 @@ class DashTestFramework(BitcoinTestFramework):
         assert (len(inputs) <= max_inputs)
         assert (in_amount >= amount)
         # fill outputs
-        receiver_address = node_to.getnewaddress()
-        change_address = node_from.getnewaddress()
         fee = 0.001
         outputs = {}
         outputs[receiver_address] = satoshi_round(amount)
@@ -793,13 +799,39 @@ class DashTestFramework(BitcoinTestFramework):
         return ret
 
     def wait_for_tx(self, txid, node, expected=True, timeout=15):
+        """Wait for txid to show up on node and return its raw hex (None if it didn't)."""
+        rawtx = None
+
         def check_tx():
+            nonlocal rawtx
             try:
-                return node.getrawtransaction(txid)
+                rawtx = node.getrawtransaction(txid)
+                return True
             except:
                 return False
-        if wait_until(check_tx, timeout=timeout, sleep=0.5, do_assert=expected) and not expected:
+        if wait_until_backoff(check_tx, timeout=timeout, do_assert=expected) and not expected:
             raise AssertionError("waiting unexpectedly succeeded")
+        return rawtx
+
+    def wait_for_tx_all_nodes(self, txid, nodes, timeout=15):
+        """Wait for txid to show up on all nodes and return its raw hex.
+
+        Uses a single predicate for all nodes and stops querying a node once it
+        knows the tx."""
+        pending = list(nodes)
+        rawtx = None
+
+        def check_tx():
+            nonlocal rawtx
+            for node in list(pending):
+                try:
+                    rawtx = node.getrawtransaction(txid)
+                except JSONRPCException:
+                    continue
+                pending.remove(node)
+            return not pending
+        wait_until_backoff(check_tx, timeout=timeout)
+        return rawtx
 
     def create_islock(self, hextx):
         tx = FromHex(CTransaction(), hextx)
@@ -843,8 +875,20 @@ class DashTestFramework(BitcoinTestFramework):
             raise AssertionError("waiting unexpectedly succeeded")
 
     def wait_for_chainlocked_block_all_nodes(self, block_hash, timeout=15):
-        for node in self.nodes:
-            self.wait_for_chainlocked_block(node, block_hash, timeout=timeout)
+        # Use a single polling loop for all nodes and stop querying nodes which already have the ChainLock
+        pending = list(self.nodes)
+
+        def check_chainlocked_block():
+            for node in list(pending):
+                try:
+                    block = node.getblock(block_hash)
+                except JSONRPCException:
+                    continue
+                if block["confirmations"] > 0 and block["chainlock"]:
+                    pending.remove(node)
+            return not pending
+        # timeout is per node, like it was when waiting for each node one after another
+        wait_until(check_chainlocked_block, timeout=timeout * len(self.nodes), sleep=0.1)
 
     def wait_for_best_chainlock(self, node, block_hash, timeout=15):
         wait_until(lambda: node.getbestchainlock()["blockhash"] == block_hash, timeout=timeout, sleep=0.1)
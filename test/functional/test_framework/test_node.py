@@ -227,6 +227,33 @@ class TestNode():
                 if re.search(re.escape(expected_msg), log, flags=re.MULTILINE) is None:
                     self._raise_assertion_error('Expected message "{}" does not partially match log:\n\n{}\n\n'.format(expected_msg, print_log))
 
+    @contextlib.contextmanager
+    def wait_for_debug_log(self, expected_msgs, timeout=10, use_regex=False):
+        """Block until all expected_msgs were logged after entering the context.
+
+        Unlike assert_debug_log this polls the log once the with-block is left,
+        which makes it suitable for waiting on asynchronous events instead of
+        sleeping for a fixed amount of time. With use_regex, expected_msgs are
+        regular expressions which have to match within a single line."""
+        chain = get_chain_folder(self.datadir, self.chain)
+        debug_log = os.path.join(self.datadir, chain, 'debug.log')
+        with open(debug_log, encoding='utf-8') as dl:
+            dl.seek(0, 2)
+            prev_size = dl.tell()
+        yield
+        time_end = time.time() + timeout * Options.timeout_scale
+        while True:
+            with open(debug_log, encoding='utf-8') as dl:
+                dl.seek(prev_size)
+                log = dl.read()
+            if all(re.search(expected_msg if use_regex else re.escape(expected_msg), log, flags=re.MULTILINE) is not None for expected_msg in expected_msgs):
+                return
+            if time.time() >= time_end:
+                break
+            time.sleep(0.05)
+        print_log = " - " + "\n - ".join(log.splitlines())
+        self._raise_assertion_error('Expected messages "{}" do not partially match log:\n\n{}\n\n'.format(expected_msgs, print_log))
+
     def assert_start_raises_init_error(self, extra_args=None, expected_msg=None, partial_match=False, *args, **kwargs):
         """Attempt to start the node and expect it to raise an error.
 
@@ -7,6 +7,7 @@
 
 from base64 import b64encode
 from binascii import hexlify, unhexlify
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal, ROUND_DOWN
 import hashlib
 import inspect
@@ -212,7 +213,7 @@ def str_to_b64str(string):
 def satoshi_round(amount):
     return Decimal(amount).quantize(Decimal('0.00000001'), rounding=ROUND_DOWN)
 
-def wait_until(predicate, *, attempts=float('inf'), timeout=float('inf'), sleep=0.05, lock=None, do_assert=True, allow_exception=False):
+def wait_until(predicate, *, attempts=float('inf'), timeout=float('inf'), sleep=0.05, sleep_step=0, max_sleep=float('inf'), lock=None, do_assert=True, allow_exception=False):
     if attempts == float('inf') and timeout == float('inf'):
         timeout = 60
     attempt = 0
@@ -233,6 +234,7 @@ def wait_until(predicate, *, attempts=float('inf'), timeout=float('inf'), sleep=
                 raise
         attempt += 1
         time.sleep(sleep)
+        sleep = min(sleep + sleep_step, max_sleep)
 
     if do_assert:
         # Print the cause of the timeout
@@ -246,6 +248,28 @@ def wait_until(predicate, *, attempts=float('inf'), timeout=float('inf'), sleep=
     else:
         return False
 
+def wait_until_backoff(predicate, *, start=0.025, step=0.025, cap=0.5, **kwargs):
+    """Like wait_until, but increase the polling interval by step after every attempt, up to cap.
+
+    This keeps the latency low for conditions which become true quickly, while
+    issuing far fewer probes during long waits."""
+    return wait_until(predicate, sleep=start, sleep_step=step, max_sleep=cap, **kwargs)
+
+def batch_rpc(node, requests):
+    """Send several RPC requests (built with get_request()) to node as a single
+    JSON-RPC batch and return their results in order.
+
+    Raises JSONRPCException if any of the requests failed."""
+    responses = node.batch(requests)
+    for response in responses:
+        # TestNodeCLI.batch() only sets 'error' for failed calls, and sets it to the exception itself
+        error = response.get('error')
+        if isinstance(error, JSONRPCException):
+            raise error
+        if error is not None:
+            raise JSONRPCException(error)
+    return [response['result'] for response in responses]
+
 # RPC/P2P connection constants and functions
 ############################################
 
@@ -406,9 +430,16 @@ def get_bip9_status(node, key):
     return info['bip9_softforks'][key]
 
 def set_node_times(nodes, t):
-    for node in nodes:
+    def set_node_time(node):
         node.mocktime = t
         node.setmocktime(t)
+    if len(nodes) <= 1:
+        for node in nodes:
+            set_node_time(node)
+        return
+    # Every node has its own RPC connection, so it's safe to update them in parallel
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        list(executor.map(set_node_time, nodes))
 
 def disconnect_nodes(from_connection, node_num):
     for peer_id in [peer['id'] for peer in from_connection.getpeerinfo() if "testnode%d" % node_num in peer['subver']]:
@@ -566,9 +597,10 @@ def random_transaction(nodes, amount, min_fee, fee_increment, fee_variants):
 # Pass in a fee that is sufficient for relay and mining new transactions.
 def create_confirmed_utxos(fee, node, count):
     to_generate = int(0.5 * count) + 101
+    # generate in large chunks, each one only needs to stay well within the RPC timeout
     while to_generate > 0:
-        node.generate(min(25, to_generate))
-        to_generate -= 25
+        node.generate(min(500, to_generate))
+        to_generate -= 500
     utxos = node.listunspent()
     iterations = count - len(utxos)
     addr1 = node.getnewaddress()
@@ -600,19 +632,11 @@ def gen_return_txouts():
     # Some pre-processing to create a bunch of OP_RETURN txouts to insert into transactions we create
     # So we have big transactions (and therefore can't fit very many into each block)
     # create one script_pubkey
-    script_pubkey = "6a4d0200"  # OP_RETURN OP_PUSH2 512 bytes
-    for i in range(512):
-        script_pubkey = script_pubkey + "01"
+    script_pubkey = "6a4d0200" + "01" * 512  # OP_RETURN OP_PUSH2 512 bytes
+    # txout value, length of script_pubkey and script_pubkey
+    txout = "0000000000000000" + "fd0402" + script_pubkey
     # concatenate 128 txouts of above script_pubkey which we'll insert before the txout for change
-    txouts = "81"
-    for k in range(128):
-        # add txout value
-        txouts = txouts + "0000000000000000"
-        # add length of script_pubkey
-        txouts = txouts + "fd0402"
-        # add script_pubkey
-        txouts = txouts + script_pubkey
-    return txouts
+    return "81" + txout * 128
 
 def create_tx(node, coinbase, to_address, amount):
     inputs = [{"txid": coinbase, "vout": 0}]
@@ -624,23 +648,20 @@ def create_tx(node, coinbase, to_address, amount):
 
 # Create a spend of each passed-in utxo, splicing in "txouts" to each raw
 # transaction to make it large.  See gen_return_txouts() above.
+# Each step is done for all transactions in a single RPC batch.
 def create_lots_of_big_transactions(node, txouts, utxos, num, fee):
     addr = node.getnewaddress()
-    txids = []
+    requests = []
     for _ in range(num):
         t = utxos.pop()
         inputs = [{"txid": t["txid"], "vout": t["vout"]}]
         outputs = {}
         change = t['amount'] - fee
         outputs[addr] = satoshi_round(change)
-        rawtx = node.createrawtransaction(inputs, outputs)
-        newtx = rawtx[0:92]
-        newtx = newtx + txouts
-        newtx = newtx + rawtx[94:]
-        signresult = node.signrawtransactionwithwallet(newtx, None, "NONE")
-        txid = node.sendrawtransaction(signresult["hex"], True)
-        txids.append(txid)
-    return txids
+        requests.append(node.createrawtransaction.get_request(inputs, outputs))
+    rawtxs = batch_rpc(node, requests)
+    signresults = batch_rpc(node, [node.signrawtransactionwithwallet.get_request(rawtx[0:92] + txouts + rawtx[94:], None, "NONE") for rawtx in rawtxs])
+    return batch_rpc(node, [node.sendrawtransaction.get_request(signresult["hex"], True) for signresult in signresults])
 
 def mine_large_block(node, utxos=None):
     # generate a 66k transaction,